@@ -7,3 +7,17 @@ JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+# WebSocket heartbeat configuration
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+
+# Broadcast coalescing (opt-in): once a room exceeds the rate threshold,
+# messages arriving within the window are sent to each member as one array frame
+WS_BATCH_ENABLED = os.getenv("WS_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+WS_BATCH_RATE_THRESHOLD = float(os.getenv("WS_BATCH_RATE_THRESHOLD", "50"))
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "5"))
+
+# Read markers are kept in memory and written to the database in batches
+READ_MARKER_FLUSH_INTERVAL_SECONDS = float(os.getenv("READ_MARKER_FLUSH_INTERVAL_SECONDS", "5"))
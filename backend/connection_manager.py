@@ -0,0 +1,185 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+from fastapi import WebSocket
+from config import (
+    WS_PING_INTERVAL_SECONDS, WS_IDLE_TIMEOUT_SECONDS, WS_SEND_TIMEOUT_SECONDS,
+    WS_BATCH_ENABLED, WS_BATCH_RATE_THRESHOLD, WS_BATCH_WINDOW_MS
+)
+
+class ConnectionManager:
+    def __init__(self, batch_enabled: bool = WS_BATCH_ENABLED, batch_rate_threshold: float = WS_BATCH_RATE_THRESHOLD, batch_window_ms: float = WS_BATCH_WINDOW_MS):
+        self.active_connections: Dict[str, List[tuple[WebSocket, str]]] = {}
+        # websocket -> monotonic time of the last frame received from the client
+        self.last_seen: Dict[WebSocket, float] = {}
+        # Number of connections removed by the server, keyed by reason
+        self.reaped_counts: Dict[str, int] = {"send_failed": 0, "send_timeout": 0, "idle_timeout": 0}
+
+        # Broadcast coalescing for busy rooms
+        self.batch_enabled = batch_enabled
+        self.batch_rate_threshold = batch_rate_threshold
+        self.batch_window = batch_window_ms / 1000
+        # room_id -> [window start, count in current window, count in previous window]
+        self.rate_windows: Dict[str, List] = {}
+        # room_id -> messages waiting for the pending flush
+        self.pending_batches: Dict[str, List[dict]] = {}
+        self.flush_tasks: Dict[str, asyncio.Task] = {}
+        self.batch_counts: Dict[str, int] = {"batched_messages": 0, "batch_frames": 0}
+
+    async def connect(self, websocket: WebSocket, room_id: str, username: str):
+        await websocket.accept()
+        if room_id not in self.active_connections:
+            self.active_connections[room_id] = []
+        self.active_connections[room_id].append((websocket, username))
+        self.last_seen[websocket] = time.monotonic()
+
+    def disconnect(self, websocket: WebSocket, room_id: str) -> Optional[str]:
+        # Returns the username if the socket was still registered, None if it was already removed
+        username = None
+        if room_id in self.active_connections:
+            remaining = []
+            for ws, user in self.active_connections[room_id]:
+                if ws is websocket:
+                    username = user
+                else:
+                    remaining.append((ws, user))
+            if remaining:
+                self.active_connections[room_id] = remaining
+            else:
+                del self.active_connections[room_id]
+                self.rate_windows.pop(room_id, None)
+        self.last_seen.pop(websocket, None)
+        return username
+
+    def touch(self, websocket: WebSocket):
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = time.monotonic()
+
+    def get_online_users(self, room_id: str) -> List[str]:
+        if room_id in self.active_connections:
+            return list(set([user for _, user in self.active_connections[room_id]]))
+        return []
+
+    def get_stats(self) -> dict:
+        return {
+            "rooms": len(self.active_connections),
+            "active_connections": sum(len(conns) for conns in self.active_connections.values()),
+            "reaped": dict(self.reaped_counts),
+            "batching": dict(self.batch_counts, enabled=self.batch_enabled)
+        }
+
+    async def send(self, websocket: WebSocket, message) -> Optional[str]:
+        # Returns the reap reason if the send failed, None on success
+        try:
+            await asyncio.wait_for(websocket.send_json(message), timeout=WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            return "send_timeout"
+        except Exception:
+            return "send_failed"
+        return None
+
+    def record_message(self, room_id: str) -> int:
+        # Returns the room's message rate over the last second (approximated with two fixed windows)
+        now = time.monotonic()
+        window = self.rate_windows.get(room_id)
+        if window is None or now - window[0] >= 1.0:
+            previous = window[1] if window is not None and now - window[0] < 2.0 else 0
+            window = [now, 0, previous]
+            self.rate_windows[room_id] = window
+        window[1] += 1
+        return max(window[1], window[2])
+
+    async def broadcast(self, message: dict, room_id: str):
+        if self.batch_enabled and room_id in self.active_connections:
+            rate = self.record_message(room_id)
+            if room_id in self.pending_batches:
+                # Join the open batch so messages keep their order
+                self.pending_batches[room_id].append(message)
+                return
+            if rate > self.batch_rate_threshold:
+                self.pending_batches[room_id] = [message]
+                self.flush_tasks[room_id] = asyncio.create_task(self.flush_later(room_id))
+                return
+        await self.deliver(message, room_id)
+
+    async def flush_later(self, room_id: str):
+        await asyncio.sleep(self.batch_window)
+        await self.flush_batch(room_id)
+
+    async def flush_batch(self, room_id: str):
+        batch = self.pending_batches.pop(room_id, [])
+        self.flush_tasks.pop(room_id, None)
+        if len(batch) == 1:
+            await self.deliver(batch[0], room_id)
+        elif batch:
+            self.batch_counts["batched_messages"] += len(batch)
+            self.batch_counts["batch_frames"] += 1
+            # One array frame per recipient instead of one frame per message
+            await self.deliver(batch, room_id)
+
+    async def flush_pending(self):
+        # Deliver batches still waiting for their window instead of dropping them (used at shutdown).
+        # A task is only in flush_tasks while it is still sleeping, so cancelling it loses nothing.
+        for task in list(self.flush_tasks.values()):
+            task.cancel()
+        await asyncio.gather(*(self.flush_batch(room_id) for room_id in list(self.pending_batches)))
+
+    async def deliver(self, message, room_id: str):
+        connections = list(self.active_connections.get(room_id, []))
+        if not connections:
+            return
+        # A dead socket must not break delivery to the others or raise in the sender's loop
+        results = await asyncio.gather(*(self.send(ws, message) for ws, _ in connections))
+        dead = [(websocket, reason) for (websocket, _), reason in zip(connections, results) if reason]
+        if dead:
+            await self.reap(dead, room_id)
+
+    async def broadcast_leave(self, room_id: str, username: str):
+        leave_message = {
+            "type": "system",
+            "action": "leave",
+            "username": username,
+            "online_users": self.get_online_users(room_id)
+        }
+        await self.broadcast(leave_message, room_id)
+
+    async def leave(self, websocket: WebSocket, room_id: str):
+        username = self.disconnect(websocket, room_id)
+        if username is not None:
+            await self.broadcast_leave(room_id, username)
+
+    async def reap(self, dead: List[tuple[WebSocket, str]], room_id: str):
+        # Unregister every dead socket first so leave notifications are not sent to them
+        reaped = []
+        for websocket, reason in dead:
+            username = self.disconnect(websocket, room_id)
+            if username is None:
+                # Already removed by another broadcast or by the endpoint itself
+                continue
+            self.reaped_counts[reason] += 1
+            reaped.append((websocket, username))
+        for websocket, username in reaped:
+            try:
+                await asyncio.wait_for(websocket.close(code=1001), timeout=WS_SEND_TIMEOUT_SECONDS)
+            except Exception:
+                pass
+            await self.broadcast_leave(room_id, username)
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL_SECONDS)
+            # Rooms run concurrently so a stalled socket in one room cannot delay pings to the others
+            await asyncio.gather(*(
+                self.heartbeat_room(room_id, connections)
+                for room_id, connections in list(self.active_connections.items())
+            ))
+
+    async def heartbeat_room(self, room_id: str, connections: List[tuple[WebSocket, str]]):
+        now = time.monotonic()
+        idle = [
+            (ws, "idle_timeout") for ws, _ in connections
+            if now - self.last_seen.get(ws, now) > WS_IDLE_TIMEOUT_SECONDS
+        ]
+        if idle:
+            await self.reap(idle, room_id)
+        await self.deliver({"type": "ping"}, room_id)
@@ -50,8 +50,20 @@ async def init_db():
                 FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
             )
         """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS read_markers (
+                user_id INTEGER NOT NULL,
+                room_id TEXT NOT NULL,
+                last_read_message_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (user_id, room_id),
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+                FOREIGN KEY (room_id) REFERENCES rooms (id)
+            )
+        """)
         await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
         await db.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_token ON refresh_tokens(token)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_messages_room_id ON messages(room_id, id)")
 
         # Migrate existing tables
         try:
@@ -100,25 +112,73 @@ async def get_room(room_id: str):
                 return {"id": row[0], "name": row[1], "password": row[2], "created_at": row[3]}
             return None
 
-async def save_message(room_id: str, username: str, content: str, message_type: str, user_id: int = None, is_guest: bool = True):
+async def save_message(room_id: str, username: str, content: str, message_type: str, user_id: int = None, is_guest: bool = True) -> int:
     async with aiosqlite.connect(DATABASE) as db:
-        await db.execute(
+        cursor = await db.execute(
             "INSERT INTO messages (room_id, username, content, message_type, created_at, user_id, is_guest) VALUES (?, ?, ?, ?, ?, ?, ?)",
             (room_id, username, content, message_type, datetime.now().isoformat(), user_id, is_guest)
         )
         await db.commit()
+        return cursor.lastrowid
 
 async def get_room_messages(room_id: str, limit: int = 100):
     async with aiosqlite.connect(DATABASE) as db:
         async with db.execute(
-            "SELECT username, content, message_type, created_at FROM messages WHERE room_id = ? ORDER BY created_at DESC LIMIT ?",
+            "SELECT id, username, content, message_type, created_at FROM messages WHERE room_id = ? ORDER BY created_at DESC LIMIT ?",
             (room_id, limit)
         ) as cursor:
             rows = await cursor.fetchall()
             messages = [{
-                "username": row[0],
-                "content": row[1],
-                "type": row[2],
-                "timestamp": row[3]
+                "id": row[0],
+                "username": row[1],
+                "content": row[2],
+                "type": row[3],
+                "timestamp": row[4]
             } for row in rows]
             return list(reversed(messages))
+
+async def get_latest_message_ids():
+    async with aiosqlite.connect(DATABASE) as db:
+        async with db.execute("SELECT room_id, MAX(id) FROM messages GROUP BY room_id") as cursor:
+            rows = await cursor.fetchall()
+            return {row[0]: row[1] for row in rows}
+
+async def get_read_markers():
+    # Unread counts are rebuilt from the markers so they stay exact even if the last flush was lost
+    async with aiosqlite.connect(DATABASE) as db:
+        async with db.execute("""
+            SELECT r.user_id, r.room_id, r.last_read_message_id,
+                   (SELECT COUNT(*) FROM messages m WHERE m.room_id = r.room_id AND m.id > r.last_read_message_id)
+            FROM read_markers r
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return [{
+                "user_id": row[0],
+                "room_id": row[1],
+                "last_read_message_id": row[2],
+                "unread_count": row[3]
+            } for row in rows]
+
+async def count_messages_between(room_id: str, after_id: int, up_to_id: int) -> int:
+    async with aiosqlite.connect(DATABASE) as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM messages WHERE room_id = ? AND id > ? AND id <= ?",
+            (room_id, after_id, up_to_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return row[0]
+
+async def save_read_markers(markers: list):
+    # markers: list of (user_id, room_id, last_read_message_id)
+    async with aiosqlite.connect(DATABASE) as db:
+        now = datetime.now().isoformat()
+        await db.executemany(
+            """
+            INSERT INTO read_markers (user_id, room_id, last_read_message_id, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, room_id) DO UPDATE SET
+                last_read_message_id = excluded.last_read_message_id,
+                updated_at = excluded.updated_at
+            """,
+            [(user_id, room_id, message_id, now) for user_id, room_id, message_id in markers]
+        )
+        await db.commit()
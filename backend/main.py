@@ -1,18 +1,22 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.websockets import WebSocketState
 from pydantic import BaseModel
 import uuid
 import os
-from typing import Dict, List, Optional
+from typing import Dict, Optional
 from datetime import datetime, timedelta
 import secrets
+import asyncio
 from database import init_db, create_room, get_rooms, get_room, save_message, get_room_messages
 from models import RegisterRequest, LoginRequest, TokenResponse, UserResponse, UpdateProfileRequest, RefreshTokenRequest, User, ChangePasswordRequest
 from auth import hash_password, verify_password, create_access_token, create_refresh_token, verify_token
 from crud import create_user, get_user_by_username, get_user_by_id, update_user, save_refresh_token, verify_refresh_token, delete_refresh_token, change_password
 from dependencies import get_current_user, get_current_user_optional
 from config import REFRESH_TOKEN_EXPIRE_DAYS
+from connection_manager import ConnectionManager
+from unread_tracker import UnreadTracker
 
 # Room access tokens storage (room_id -> set of valid tokens)
 room_access_tokens: Dict[str, set] = {}
@@ -37,37 +41,22 @@ class RoomJoin(BaseModel):
     room_id: str
     password: Optional[str] = None
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[tuple[WebSocket, str]]] = {}
-
-    async def connect(self, websocket: WebSocket, room_id: str, username: str):
-        await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append((websocket, username))
-
-    def disconnect(self, websocket: WebSocket, room_id: str):
-        if room_id in self.active_connections:
-            self.active_connections[room_id] = [
-                (ws, user) for ws, user in self.active_connections[room_id] if ws != websocket
-            ]
-
-    def get_online_users(self, room_id: str) -> List[str]:
-        if room_id in self.active_connections:
-            return list(set([user for _, user in self.active_connections[room_id]]))
-        return []
-
-    async def broadcast(self, message: dict, room_id: str):
-        if room_id in self.active_connections:
-            for websocket, _ in self.active_connections[room_id]:
-                await websocket.send_json(message)
-
 manager = ConnectionManager()
+unread_tracker = UnreadTracker()
 
 @app.on_event("startup")
 async def startup():
     await init_db()
+    await unread_tracker.load()
+    app.state.heartbeat_task = asyncio.create_task(manager.heartbeat())
+    app.state.read_marker_task = asyncio.create_task(unread_tracker.flush_periodically())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.heartbeat_task.cancel()
+    app.state.read_marker_task.cancel()
+    await manager.flush_pending()
+    await unread_tracker.flush()
 
 @app.post("/api/rooms")
 async def create_new_room(room: RoomCreate):
@@ -121,6 +110,10 @@ async def get_messages(room_id: str, limit: int = 100, room_access_token: Option
     messages = await get_room_messages(room_id, limit)
     return messages
 
+@app.get("/api/stats/connections")
+async def connection_stats():
+    return manager.get_stats()
+
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...)):
     file_ext = os.path.splitext(file.filename)[1]
@@ -249,6 +242,11 @@ async def upload_avatar(file: UploadFile = File(...), current_user: User = Depen
 
     return {"avatar_url": avatar_url}
 
+@app.get("/api/users/me/unread")
+async def get_unread_counts(current_user: User = Depends(get_current_user)):
+    # room_id -> unread message count, served from memory
+    return unread_tracker.get_unread_counts(current_user.id)
+
 @app.post("/api/users/me/password")
 async def change_user_password(request: ChangePasswordRequest, current_user: User = Depends(get_current_user)):
     # Verify old password
@@ -300,6 +298,8 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, username: Optio
         return
 
     await manager.connect(websocket, room_id, display_username)
+    if not is_guest:
+        unread_tracker.join(user_id, room_id)
 
     # Send join notification
     join_message = {
@@ -311,21 +311,26 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, username: Optio
     await manager.broadcast(join_message, room_id)
 
     try:
-        while True:
+        # The socket may be closed by the manager (failed send or idle timeout) while this loop is busy
+        while websocket.application_state == WebSocketState.CONNECTED:
             data = await websocket.receive_json()
-            await save_message(room_id, data["username"], data["content"], data["type"], user_id, is_guest)
+            manager.touch(websocket)
+            if data.get("type") == "pong":
+                continue
+            if data.get("type") == "ack":
+                # Read marker update from an authenticated client
+                if not is_guest and isinstance(data.get("message_id"), int):
+                    await unread_tracker.ack(user_id, room_id, data["message_id"])
+                continue
+            message_id = await save_message(room_id, data["username"], data["content"], data["type"], user_id, is_guest)
+            data["id"] = message_id
+            unread_tracker.on_message(room_id, message_id, user_id if not is_guest else None)
             await manager.broadcast(data, room_id)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id)
-
-        # Send leave notification
-        leave_message = {
-            "type": "system",
-            "action": "leave",
-            "username": display_username,
-            "online_users": manager.get_online_users(room_id)
-        }
-        await manager.broadcast(leave_message, room_id)
+        pass
+    finally:
+        # Sends leave notification unless the socket was already reaped
+        await manager.leave(websocket, room_id)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,116 @@
+import asyncio
+import bisect
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+from database import get_latest_message_ids, get_read_markers, count_messages_between, save_read_markers
+from config import READ_MARKER_FLUSH_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Message ids kept in memory per room for exact unread counts without a database query
+RECENT_MESSAGE_IDS_PER_ROOM = 1000
+
+class UnreadTracker:
+    def __init__(self):
+        # user_id -> room_id -> id of the last message the user has read
+        self.read_markers: Dict[int, Dict[str, int]] = {}
+        # user_id -> room_id -> number of messages after the read marker
+        self.unread_counts: Dict[int, Dict[str, int]] = {}
+        # room_id -> user ids holding a read marker in the room
+        self.room_readers: Dict[str, Set[int]] = {}
+        # room_id -> id of the newest message in the room
+        self.latest_message_ids: Dict[str, int] = {}
+        # room_id -> sorted ids of recent messages; every message above the room's floor is in the list
+        self.recent_message_ids: Dict[str, List[int]] = {}
+        self.recent_floors: Dict[str, int] = {}
+        # (user_id, room_id) pairs whose marker changed since the last flush
+        self.dirty: Set[Tuple[int, str]] = set()
+        self.flush_failures = 0
+
+    async def load(self):
+        self.latest_message_ids = await get_latest_message_ids()
+        # Messages up to the current newest are already in the database counts below
+        self.recent_floors = dict(self.latest_message_ids)
+        for marker in await get_read_markers():
+            self.set_marker(marker["user_id"], marker["room_id"], marker["last_read_message_id"], marker["unread_count"])
+
+    def set_marker(self, user_id: int, room_id: str, message_id: int, unread_count: int):
+        self.read_markers.setdefault(user_id, {})[room_id] = message_id
+        self.unread_counts.setdefault(user_id, {})[room_id] = unread_count
+        self.room_readers.setdefault(room_id, set()).add(user_id)
+
+    def join(self, user_id: int, room_id: str):
+        # First visit starts the user at the newest message, so old history is not unread
+        if room_id not in self.read_markers.get(user_id, {}):
+            self.set_marker(user_id, room_id, self.latest_message_ids.get(room_id, 0), 0)
+            self.dirty.add((user_id, room_id))
+
+    def count_recent_after(self, room_id: str, message_id: int) -> int:
+        recent = self.recent_message_ids.get(room_id, [])
+        return len(recent) - bisect.bisect_right(recent, message_id)
+
+    def on_message(self, room_id: str, message_id: int, sender_id: Optional[int] = None):
+        # Handlers finish save_message in any order, so ids may arrive out of order here
+        floor = self.recent_floors.get(room_id, 0)
+        if message_id > floor:
+            recent = self.recent_message_ids.setdefault(room_id, [])
+            bisect.insort(recent, message_id)
+            if len(recent) > RECENT_MESSAGE_IDS_PER_ROOM:
+                floor = self.recent_floors[room_id] = recent.pop(0)
+        self.latest_message_ids[room_id] = max(self.latest_message_ids.get(room_id, 0), message_id)
+
+        for user_id in self.room_readers.get(room_id, ()):
+            if message_id <= self.read_markers[user_id][room_id]:
+                continue
+            if user_id == sender_id and message_id > floor:
+                # Posting implies the sender has caught up to their own message; later ones stay unread
+                self.read_markers[user_id][room_id] = message_id
+                self.unread_counts[user_id][room_id] = self.count_recent_after(room_id, message_id)
+                self.dirty.add((user_id, room_id))
+            else:
+                self.unread_counts[user_id][room_id] += 1
+
+    async def ack(self, user_id: int, room_id: str, message_id: int):
+        markers = self.read_markers.get(user_id, {})
+        message_id = min(message_id, self.latest_message_ids.get(room_id, 0))
+        if room_id not in markers or message_id <= markers[room_id]:
+            return
+        while True:
+            floor = self.recent_floors.get(room_id, 0)
+            older = 0
+            if message_id < floor:
+                # Acknowledging a message older than the in-memory window is rare; ids up to the
+                # floor no longer change, so counting them in the database cannot race on_message
+                older = await count_messages_between(room_id, message_id, floor)
+            if self.recent_floors.get(room_id, 0) == floor:
+                break
+        # A concurrent ack may have moved the marker further during the await
+        if message_id <= markers[room_id]:
+            return
+        unread_count = older + self.count_recent_after(room_id, max(message_id, floor))
+        self.set_marker(user_id, room_id, message_id, unread_count)
+        self.dirty.add((user_id, room_id))
+
+    def get_unread_counts(self, user_id: int) -> Dict[str, int]:
+        return dict(self.unread_counts.get(user_id, {}))
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        markers = [(user_id, room_id, self.read_markers[user_id][room_id]) for user_id, room_id in dirty]
+        try:
+            await save_read_markers(markers)
+        except Exception:
+            # Keep the markers for the next flush
+            self.dirty |= dirty
+            raise
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(READ_MARKER_FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                self.flush_failures += 1
+                logger.exception("Failed to save %d read markers (%d failed flushes so far)", len(self.dirty), self.flush_failures)